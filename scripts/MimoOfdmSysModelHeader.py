@@ -5,32 +5,40 @@ Created on Mon Oct 17 22:43:09 2022
 @author: voche
 """
 
-# Configure the notebook to use only a single GPU and allocate only as much memory as needed
-# For more details, see https://www.tensorflow.org/guide/gpu
+# Allow FP32 matmuls/solves (e.g. in the LMMSE equalizer) to run on TF32 tensor cores.
+# The override must be set before tensorflow is imported.
+import os
+# setdefault() keeps a user's NVIDIA_TF32_OVERRIDE=0 debug switch.
+os.environ.setdefault("NVIDIA_TF32_OVERRIDE", "1")
+
+# Opt-in: set XLA_CACHE_DIR to persist XLA-compiled executables in that directory,
+# so that later runs skip recompilation. Needs a TF version that knows the
+# --tf_xla_persistent_cache_directory flag, older versions abort on it.
+# Only append the flag once, e.g., worker processes inherit it from the parent.
+if (os.environ.get("XLA_CACHE_DIR")
+        and "tf_xla_persistent_cache_directory" not in os.environ.get("TF_XLA_FLAGS", "")):
+    os.environ["TF_XLA_FLAGS"] = (os.environ.get("TF_XLA_FLAGS", "")
+                                  + " --tf_xla_persistent_cache_directory="
+                                  + os.environ["XLA_CACHE_DIR"]).strip()
+
 import tensorflow as tf
-gpus = tf.config.list_physical_devices('GPU')
-print('Number of GPUs available :', len(gpus))
-if gpus:
-    gpu_num = 0 # Number of the GPU to be used
-    try:
-        tf.config.set_visible_devices(gpus[gpu_num], 'GPU')
-        print('Only GPU number', gpu_num, 'used.')
-        tf.config.experimental.set_memory_growth(gpus[gpu_num], True)
-    except RuntimeError as e:
-        print(e)
-
-%matplotlib inline
+
+# Inline plots under IPython/Jupyter, the magic is a syntax error in plain Python
+# (e.g. in spawned worker processes)
+try:
+    get_ipython().run_line_magic("matplotlib", "inline")
+except NameError:
+    pass
 import matplotlib.pyplot as plt
 import numpy as np
 import time
-import pickle
+import functools
 
 # Import Sionna
 try:
     import sionna
 except ImportError as e:
     # Install Sionna if package is not already installed
-    import os
     os.system("pip install sionna")
     import sionna
 
@@ -43,32 +51,218 @@ from sionna.channel.tr38901 import Antenna, AntennaArray, CDL, UMi, UMa, RMa
 from sionna.channel import gen_single_sector_topology as gen_topology
 from sionna.channel import subcarrier_frequencies, cir_to_ofdm_channel, cir_to_time_channel
 from sionna.channel import ApplyOFDMChannel, ApplyTimeChannel, OFDMChannel
+from sionna.channel import GenerateOFDMChannel, AWGN
 
 from sionna.fec.ldpc.encoding import LDPC5GEncoder
 from sionna.fec.ldpc.decoding import LDPC5GDecoder
 
 from sionna.mapping import Mapper, Demapper
 
-from sionna.utils import BinarySource, ebnodb2no, sim_ber, QAMSource
+from sionna.utils import BinarySource, ebnodb2no, QAMSource
+from sionna.utils import flatten_last_dims, expand_to_rank
 from sionna.utils.metrics import compute_ber
 
-# We need to enable sionna.config.xla_compat before we can use
-# tf.function with jit_compile=True.
-# See https://nvlabs.github.io/sionna/api/config.html#sionna.Config.xla_compat
-sionna.config.xla_compat=True
+@functools.lru_cache(maxsize=None)
+def _init_runtime():
+    """One-shot GPU, TF and Sionna configuration, safe to call repeatedly"""
+    tf.config.experimental.enable_tensor_float_32_execution(True)
+
+    # Configure the notebook to use only a single GPU and allocate only as much memory as needed
+    # For more details, see https://www.tensorflow.org/guide/gpu
+    gpus = tf.config.list_physical_devices('GPU')
+    print('Number of GPUs available :', len(gpus))
+    if gpus:
+        gpu_num = 0 # Number of the GPU to be used
+        try:
+            tf.config.set_visible_devices(gpus[gpu_num], 'GPU')
+            print('Only GPU number', gpu_num, 'used.')
+            tf.config.experimental.set_memory_growth(gpus[gpu_num], True)
+        except RuntimeError as e:
+            print(e)
+
+    # Let XLA auto-cluster ops that are not covered by jit_compile=True
+    tf.config.optimizer.set_jit("autoclustering")
+
+    # We need to enable sionna.config.xla_compat before we can use
+    # tf.function with jit_compile=True.
+    # See https://nvlabs.github.io/sionna/api/config.html#sionna.Config.xla_compat
+    sionna.config.xla_compat=True
+
+_init_runtime()
+
+
+# STATIC RESOURCE GRID MAPPER
+class StaticResourceGridMapper(tf.keras.layers.Layer):
+    """Map data symbols and pilots onto the resource grid with a single gather.
+
+    The pilot pattern is static, so the source of every resource element
+    (data symbol, pilot or nulled subcarrier) is precomputed once as an index
+    into the concatenation [data symbols, pilots, 0].
+    """
+    def __init__(self, resource_grid, dtype=tf.complex64, **kwargs):
+        super().__init__(dtype=dtype, **kwargs)
+
+        # mask: [num_tx, num_streams, num_ofdm_symbols, num_effective_subcarriers]
+        # pilots: [num_tx, num_streams, num_pilot_symbols]
+        mask = np.asarray(resource_grid.pilot_pattern.mask) != 0
+        pilots = np.asarray(resource_grid.pilot_pattern.pilots)
+        num_tx, num_streams, num_ofdm_symbols, num_subcarriers = mask.shape
+        num_data_symbols = int(resource_grid.num_data_symbols)
+        num_pilots = pilots.shape[-1]
+        effective_subcarrier_ind = np.asarray(resource_grid.effective_subcarrier_ind)
+
+        # Index of the source of every resource element, nulled subcarriers
+        # point to the trailing zero
+        num_data_total = num_tx*num_streams*num_data_symbols
+        zero_ind = num_data_total + num_tx*num_streams*num_pilots
+        perm = np.full([num_tx, num_streams, num_ofdm_symbols, resource_grid.fft_size],
+                       zero_ind, np.int32)
+        for tx in range(num_tx):
+            for st in range(num_streams):
+                # Data symbols and pilots are mapped in the flattened grid order
+                stream_ind = tx*num_streams + st
+                m = mask[tx, st].flatten()
+                ind = np.zeros(m.shape, np.int32)
+                ind[~m] = stream_ind*num_data_symbols + np.arange(num_data_symbols)
+                ind[m] = num_data_total + stream_ind*num_pilots + np.arange(num_pilots)
+                perm[tx, st][:, effective_subcarrier_ind] = ind.reshape(num_ofdm_symbols, num_subcarriers)
+
+        self._perm = tf.constant(perm)
+        self._pilots = tf.constant(pilots.flatten(), dtype)
+
+    def call(self, inputs):
+        # [batch_size, num_tx*num_streams*num_data_symbols]
+        x = flatten_last_dims(inputs, 3)
+        batch_size = tf.shape(x)[0]
+        pilots = tf.tile(self._pilots[tf.newaxis], [batch_size, 1])
+        zero = tf.zeros([batch_size, 1], self.dtype)
+
+        # [batch_size, num_tx, num_streams, num_ofdm_symbols, fft_size]
+        return tf.gather(tf.concat([x, pilots, zero], axis=-1), self._perm, axis=-1)
+
+
+# NEAREST-PILOT LS CHANNEL ESTIMATOR
+class NearestPilotLSChannelEstimator(tf.keras.layers.Layer):
+    """LS channel estimation with nearest-pilot interpolation as a single gather.
+
+    The pilot pattern is static, so the index of the nearest non-zero pilot
+    (L1 distance over OFDM symbol and subcarrier) of every resource element is
+    precomputed once. Interpolation then reduces to one tf.gather on the
+    flattened LS estimates.
+    """
+    def __init__(self, resource_grid, dtype=tf.complex64, **kwargs):
+        super().__init__(dtype=dtype, **kwargs)
+        self._effective_subcarrier_ind = resource_grid.effective_subcarrier_ind
+
+        # mask: [num_tx, num_streams, num_ofdm_symbols, num_effective_subcarriers]
+        # pilots: [num_tx, num_streams, num_pilot_symbols]
+        mask = np.asarray(resource_grid.pilot_pattern.mask) != 0
+        pilots = np.asarray(resource_grid.pilot_pattern.pilots)
+        num_tx, num_streams, num_ofdm_symbols, num_subcarriers = mask.shape
+        num_pilots = pilots.shape[-1]
+
+        symbol_ind, subcarrier_ind = np.meshgrid(np.arange(num_ofdm_symbols),
+                                                 np.arange(num_subcarriers),
+                                                 indexing="ij")
+        pilot_ind = np.zeros([num_tx, num_streams, num_pilots], np.int32)
+        nn_ind = np.zeros(mask.shape, np.int32)
+        for tx in range(num_tx):
+            for st in range(num_streams):
+                # Flattened resource elements carrying pilots, in mapping order
+                pilot_ind[tx, st] = np.where(mask[tx, st].flatten())[0]
+
+                # Only non-zero pilots provide an LS estimate
+                p = np.where(np.abs(pilots[tx, st]) > 0)[0]
+                l, k = np.unravel_index(pilot_ind[tx, st, p], [num_ofdm_symbols, num_subcarriers])
+                dist = np.abs(symbol_ind[..., None] - l) + np.abs(subcarrier_ind[..., None] - k)
+
+                # Linear index into the flattened [num_tx, num_streams, num_pilots] estimates
+                nn_ind[tx, st] = (tx*num_streams + st)*num_pilots + p[np.argmin(dist, axis=-1)]
+
+        self._pilot_ind = tf.constant(pilot_ind)
+        self._nn_ind = tf.constant(nn_ind)
+        self._pilots = tf.constant(pilots, dtype)
+
+        # Error variance of the LS estimate is no/|p|^2 of the pilot used
+        pilot_energy = np.abs(pilots.flatten())**2
+        self._err_var_scale = tf.constant(1/pilot_energy[nn_ind], dtype.real_dtype)
+
+    def call(self, inputs):
+        y, no = inputs
+
+        # [batch_size, num_rx, num_rx_ant, num_ofdm_symbols*num_effective_subcarriers]
+        y = tf.gather(y, self._effective_subcarrier_ind, axis=-1)
+        y = flatten_last_dims(y, 2)
+
+        # LS estimates at the pilot positions
+        # [batch_size, num_rx, num_rx_ant, num_tx, num_streams, num_pilot_symbols]
+        y_pilots = tf.gather(y, self._pilot_ind, axis=-1)
+        h_ls = tf.math.divide_no_nan(y_pilots, self._pilots)
+
+        # Nearest-pilot interpolation
+        # [batch_size, num_rx, num_rx_ant, num_tx, num_streams, num_ofdm_symbols, num_effective_subcarriers]
+        h_hat = tf.gather(flatten_last_dims(h_ls, 3), self._nn_ind, axis=-1)
+
+        err_var = expand_to_rank(no, h_hat.shape.rank, axis=-1)*self._err_var_scale
+        return h_hat, err_var
+
+
+# SPLIT-COMPLEX OFDM CHANNEL APPLICATION
+class SplitComplexApplyOFDMChannel(tf.keras.layers.Layer):
+    """Apply a frequency-domain channel on separate real and imaginary parts.
+
+    Computes y = sum over (tx, tx_ant) of h*x with four real-valued einsums on
+    contiguous float tensors, so that XLA emits plain FP32 multiply-adds
+    instead of complex arithmetic on interleaved data.
+    """
+    def call(self, inputs):
+        # x: [batch_size, num_tx, num_tx_ant, num_ofdm_symbols, fft_size]
+        # h: [batch_size, num_rx, num_rx_ant, num_tx, num_tx_ant, num_ofdm_symbols, fft_size]
+        x, h = inputs
+        x_re, x_im = tf.math.real(x), tf.math.imag(x)
+        h_re, h_im = tf.math.real(h), tf.math.imag(h)
+
+        # [batch_size, num_rx, num_rx_ant, num_ofdm_symbols, fft_size]
+        eq = "bratslk,btslk->bralk"
+        y_re = tf.einsum(eq, h_re, x_re) - tf.einsum(eq, h_im, x_im)
+        y_im = tf.einsum(eq, h_re, x_im) + tf.einsum(eq, h_im, x_re)
+        return tf.complex(y_re, y_im)
+
+
+# CLOSED-FORM QPSK DEMAPPER
+class QPSKDemapper(tf.keras.layers.Layer):
+    """Exact APP demapping of Sionna's Gray-labeled QPSK in closed form.
+
+    For the constellation ((1-2*b0) + j*(1-2*b1))/sqrt(2), the LLRs
+    ln(Pr(b=1)/Pr(b=0)) are linear in the equalized symbol, so the
+    log-sum-exp over constellation points of the "app" demapper reduces to
+    two multiplications.
+    """
+    def call(self, inputs):
+        # x_hat, no: [batch_size, num_tx, num_streams, num_data_symbols]
+        x_hat, no = inputs
+        scale = -2*np.sqrt(2)/no
+        llr = tf.stack([scale*tf.math.real(x_hat), scale*tf.math.imag(x_hat)], axis=-1)
+
+        # [batch_size, num_tx, num_streams, num_data_symbols*2]
+        return flatten_last_dims(llr, 2)
 
 
 # SYSTEM KERAS MODEL FOR BER SIMULATIONS
 class MimoOfdmSystemModel(tf.keras.Model):
     """Simulate OFDM MIMO transmissions over a 3GPP 38.901 model.
     """
-    def __init__(self, scenario, perfect_csi, speed):
+    def __init__(self, scenario, perfect_csi, speed, encoder=None, decoder=None,
+                 cn_type=None):
         super().__init__()
 
         # Provided parameters
         self._scenario = scenario
         self._perfect_csi = perfect_csi
-        self._speed = speed
+
+        # UT speed is a variable so that it can be changed with set_speed()
+        # without retracing/recompiling call()
+        self._speed = tf.Variable(speed, trainable=False, dtype=tf.float32)
 
         # Internally set parameters
         self._carrier_frequency = 28e9 #3.5e9
@@ -154,48 +348,205 @@ class MimoOfdmSystemModel(tf.keras.Model):
 
         self._n = int(self._rg.num_data_symbols*self._num_bits_per_symbol) # Number of coded bits
         self._k = int(self._n*self._coderate)                              # Number of information bits
-        self._encoder = LDPC5GEncoder(self._k, self._n)
-        self._decoder = LDPC5GDecoder(self._encoder)
+
+        # The LDPC code only depends on (k, n), so encoder and decoder can be
+        # built once and shared across models (see the encoder/decoder properties)
+        if encoder is None:
+            encoder = LDPC5GEncoder(self._k, self._n)
+        if decoder is None:
+            # cn_type="minsum" replaces the tanh/log evaluations of the default
+            # "boxplus-phi" check-node update by compare/select, but costs about
+            # 1 dB (roughly 3x the BLER in the UMi perfect-CSI sweep)
+            decoder = LDPC5GDecoder(encoder, cn_type=cn_type or "boxplus-phi", hard_out=True)
+        elif cn_type is not None:
+            raise ValueError("cn_type cannot be set together with a shared decoder")
+        self._encoder = encoder
+        self._decoder = decoder
         self._mapper = Mapper("qam", self._num_bits_per_symbol)
-        self._rg_mapper = ResourceGridMapper(self._rg)
+        self._rg_mapper = StaticResourceGridMapper(self._rg)
 
-        self._ofdm_channel = OFDMChannel(self._channel_model, self._rg, add_awgn=True,
-                                         normalize_channel=True, return_channel=True)
+        # The link is simulated in the frequency domain: there is no OFDMModulator/
+        # OFDMDemodulator and hence no per-symbol (I)FFT on the simulation path
+        self._gen_ofdm_channel = GenerateOFDMChannel(self._channel_model, self._rg,
+                                                     normalize_channel=True)
+        self._apply_ofdm_channel = SplitComplexApplyOFDMChannel()
+        self._awgn = AWGN()
 
         self._remove_nulled_subcarriers = RemoveNulledSubcarriers(self._rg)
-        self._ls_est = LSChannelEstimator(self._rg, interpolation_type="nn")
+        self._ls_est = NearestPilotLSChannelEstimator(self._rg)
         self._lmmse_equ = LMMSEEqualizer(self._rg, self._sm)
-        self._demapper = Demapper("app", "qam", self._num_bits_per_symbol)
+
+        # QPSK LLRs have a closed form, higher orders use the exact "app" demapper
+        if self._num_bits_per_symbol == 2:
+            self._demapper = QPSKDemapper()
+        else:
+            self._demapper = Demapper("app", "qam", self._num_bits_per_symbol)
+
+        # Specialize the channel estimation at construction time so that the
+        # traced graph contains a single branch-free estimator
+        if self._perfect_csi:
+            self._estimate_channel = self._perfect_channel_estimate
+        else:
+            self._estimate_channel = self._ls_channel_estimate
+
+    @property
+    def encoder(self):
+        """LDPC encoder, can be shared with other models"""
+        return self._encoder
+
+    @property
+    def decoder(self):
+        """LDPC decoder, can be shared with other models"""
+        return self._decoder
+
+    def ebnodb2no(self, ebno_db):
+        """Noise variance(s) for the given Eb/N0 value(s) [dB], evaluated outside of simulate()"""
+        return ebnodb2no(np.asarray(ebno_db, np.float32),
+                         self._num_bits_per_symbol,
+                         self._coderate,
+                         self._rg)
+
+    def set_speed(self, speed):
+        """Set UT speed [m/s] used for the following topologies"""
+        self._speed.assign(speed)
 
     def new_topology(self, batch_size):
         """Set new network topology"""
-        topology = gen_topology(batch_size,
-                                self._num_ut,
-                                self._scenario,
-                                min_ut_velocity=self._speed,
-                                max_ut_velocity=self._speed)
+        topology = list(gen_topology(batch_size,
+                                     self._num_ut,
+                                     self._scenario,
+                                     min_ut_velocity=1.0,
+                                     max_ut_velocity=1.0))
+
+        """Scale the unit-speed UT velocities by the current speed"""
+        topology[4] = topology[4]*self._speed
+
         """Set topology"""
         self._channel_model.set_topology(*topology)
         
         """Visualize topology"""
         #self._channel_model.show_topology()
 
+    def _perfect_channel_estimate(self, y, h, no):
+        """Use the true channel frequency response as estimate"""
+        return self._remove_nulled_subcarriers(h), 0.0
+
+    def _ls_channel_estimate(self, y, h, no):
+        """LS channel estimation with nearest-neighbor interpolation"""
+        return self._ls_est([y, no])
 
     @tf.function(jit_compile=True)
-    def call(self, batch_size, ebno_db):
+    def _draw_channel(self, batch_size):
+        """Draw bits, resource grids and channel frequency responses (no noise)"""
         self.new_topology(batch_size)
-        no = ebnodb2no(ebno_db, self._num_bits_per_symbol, self._coderate, self._rg)
         b = self._binary_source([batch_size, self._num_tx, self._num_streams_per_tx, self._k])
         c = self._encoder(b)
         x = self._mapper(c)
         x_rg = self._rg_mapper(x)
-        y, h = self._ofdm_channel([x_rg, no])
-        if self._perfect_csi:
-            h_hat = self._remove_nulled_subcarriers(h)
-            err_var = 0.0
-        else:
-            h_hat, err_var = self._ls_est ([y, no])
+        h = self._gen_ofdm_channel(batch_size)
+        return b, x_rg, h
+
+    @tf.function(jit_compile=True)
+    def _apply_noise_and_decode(self, b, x_rg, h, no):
+        """Receive the same channel realizations at every noise variance in no"""
+        # The batch is SNR-major, i.e., sample i belongs to noise variance
+        # no[i // batch_size]
+        no = tf.reshape(no, [-1])
+        num_snr = no.shape[0]
+        batch_size = b.shape[0]
+
+        # Apply the channel once and reuse the noiseless output for all SNR points
+        y = self._apply_ofdm_channel([x_rg, h])
+        b, y, h = [tf.tile(t, [num_snr] + [1]*(len(t.shape) - 1)) for t in (b, y, h)]
+        no = tf.repeat(no, batch_size)
+        y = self._awgn([y, no])
+
+        h_hat, err_var = self._estimate_channel(y, h, no)
         x_hat, no_eff = self._lmmse_equ([y, h_hat, err_var, no])
         llr = self._demapper([x_hat, no_eff])
+
+        # Decode the codewords of all SNR points, UTs and streams as one flat
+        # batch of [num_snr*batch_size*num_tx*num_streams, n] LLRs
+        llr = tf.reshape(llr, [-1, self._n])
         b_hat = self._decoder(llr)
+        b_hat = tf.reshape(b_hat, b.shape)
         return b, b_hat
+
+    def call(self, batch_size, ebno_db):
+        """Eb/N0 [dB] entry point, compatible with Sionna's sim_ber"""
+        no = ebnodb2no(ebno_db, self._num_bits_per_symbol, self._coderate, self._rg)
+        return self.simulate(batch_size, no)
+
+    def simulate(self, batch_size, no):
+        """Simulate batch_size links per noise variance in no, see ebnodb2no()"""
+        # The channel does not depend on the SNR: draw it once for batch_size
+        # links and only apply noise, estimation, equalization and decoding
+        # per SNR point
+        b, x_rg, h = self._draw_channel(batch_size)
+        return self._apply_noise_and_decode(b, x_rg, h, no)
+
+
+# BATCHED BER SIMULATION
+@tf.function
+def _sim_ber_loop(model, no, batch_size, max_mc_iter, num_target_block_errors):
+    """Accumulate bit/block errors per SNR point on the device.
+
+    Like in sim_ber, an SNR point stops accumulating once it has collected
+    num_target_block_errors block errors. The stop test is part of the
+    tf.while_loop condition, so the host only synchronizes once the loop has
+    finished.
+    """
+    num_snr = no.shape[0]
+    zeros = tf.zeros([num_snr], tf.int64)
+
+    def cond(i, bit_errors, block_errors, num_bits, num_blocks):
+        return tf.logical_and(i < max_mc_iter,
+                              tf.reduce_min(block_errors) < num_target_block_errors)
+
+    def body(i, bit_errors, block_errors, num_bits, num_blocks):
+        b, b_hat = model.simulate(batch_size, no)
+
+        # [num_snr, num_codewords_per_snr, k]
+        b = tf.reshape(b, [num_snr, -1, b.shape[-1]])
+        b_hat = tf.reshape(b_hat, [num_snr, -1, b_hat.shape[-1]])
+        errors = tf.not_equal(b, b_hat)
+
+        # Converged SNR points keep their counts, the others accumulate
+        active = tf.cast(block_errors < num_target_block_errors, tf.int64)
+        bit_errors += active*tf.reduce_sum(tf.cast(errors, tf.int64), axis=[1, 2])
+        block_errors += active*tf.reduce_sum(tf.cast(tf.reduce_any(errors, axis=-1), tf.int64), axis=1)
+        num_bits += active*tf.cast(tf.size(b[0]), tf.int64)
+        num_blocks += active*tf.cast(tf.shape(b)[1], tf.int64)
+        return i + 1, bit_errors, block_errors, num_bits, num_blocks
+
+    _, bit_errors, block_errors, num_bits, num_blocks = tf.while_loop(
+        cond, body, [tf.constant(0), zeros, zeros, zeros, zeros], parallel_iterations=1)
+    return bit_errors, block_errors, num_bits, num_blocks
+
+
+def sim_ber_batched(model, ebno_dbs, batch_size, max_mc_iter, num_target_block_errors=None):
+    """Monte-Carlo BER/BLER simulation evaluating all SNR points per forward pass.
+
+    Unlike sim_ber, which loops over ebno_dbs in Python, every iteration runs
+    the model once on the whole SNR grid. Each SNR point stops counting once it
+    has collected num_target_block_errors block errors, and the loop ends when
+    all points have converged or after max_mc_iter iterations. A point without
+    errors is thus only known at the end of the loop, so points above it are
+    simulated rather than skipped as with sim_ber's early stop.
+    """
+    # Eb/N0 -> noise variance conversion is done once, outside of the model
+    no = model.ebnodb2no(ebno_dbs)
+
+    if num_target_block_errors is None:
+        num_target_block_errors = np.iinfo(np.int64).max
+
+    bit_errors, block_errors, num_bits, num_blocks = _sim_ber_loop(
+        model,
+        no,
+        batch_size,
+        tf.constant(max_mc_iter, tf.int32),
+        tf.constant(num_target_block_errors, tf.int64))
+
+    ber = tf.cast(bit_errors, tf.float64)/tf.cast(num_bits, tf.float64)
+    bler = tf.cast(block_errors, tf.float64)/tf.cast(num_blocks, tf.float64)
+    return ber, bler
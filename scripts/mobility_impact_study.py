@@ -3,68 +3,178 @@
 Created on Tue Oct 18 13:01:00 2022
 @author: voche
 """
-import scripts.MimoOfdmSysModelHeader as mos
+# The model header (and thus tensorflow) is only imported once the GPU of the
+# process is known, see simulate_scenario() and the main block below
+import os
+import time
+import argparse
+import multiprocessing as mp
+import numpy as np
+import matplotlib.pyplot as plt
 
-# STUDIES    
+# Plot labels of the supported channel models
+SCENARIO_LABELS = {
+    "umi" : "UMi",
+    "uma" : "UMa",
+    "rma" : "RMa",
+    "A" : "CDL-A",
+    "B" : "CDL-B",
+    "C" : "CDL-C",
+    "D" : "CDL-D",
+    "E" : "CDL-E"
+}
+
+
+def plot_metric(metric, ylabel):
+    """Plot a simulated metric over Eb/N0 for all scenarios and speeds"""
+    plt.figure()
+    plt.xlabel(r"$E_b/N_0$ (dB)")
+    plt.ylabel(ylabel)
+    plt.grid(which="both")
+
+    legend = []
+    for i, scenario in enumerate(MOBILITY_SIMS["scenario"]):
+        for j, speed in enumerate(MOBILITY_SIMS["speed"]):
+            plt.semilogy(MOBILITY_SIMS["ebno_db"], MOBILITY_SIMS[metric][i, j]);
+
+            s = "{} - {} CSI {}[m/s]".format(SCENARIO_LABELS[scenario], "perf.", speed)
+            legend.append(s)
+
+    plt.legend(legend)
+    plt.ylim([1e-3, 1])
+    plt.title("Different 3GPP 38.901 Models Multiuser 4x8 MIMO Uplink - impact of UT mobility ");
+
+
+# STUDIES
 # mobility studies
 
 MOBILITY_SIMS = {
-    "ebno_db" : list(mos.np.arange(-5, 15, 1.0)),
+    "ebno_db" : list(np.arange(-5, 15, 1.0)),
     "scenario" : ["umi", "uma", "rma"],
     "perfect_csi" : [True, False],
     "speed" : [0.0, 20.0, 30.0],
-    "ber" : [],
-    "bler" : [],
+    "ber" : None,
+    "bler" : None,
     "duration" : None
 }
 
-start = mos.time.time()
-
-for scenario in MOBILITY_SIMS["scenario"]:
-    for speed in MOBILITY_SIMS["speed"]:
-
-        model = mos.MimoOfdmSystemModel(scenario=scenario,
-                                    perfect_csi=MOBILITY_SIMS["perfect_csi"][0],
-                                    speed=speed)
-
-        ber, bler = mos.sim_ber(model,
-                            MOBILITY_SIMS["ebno_db"],
-                            batch_size=256,
-                            max_mc_iter=100,
-                            num_target_block_errors=1000)
-
-        MOBILITY_SIMS["ber"].append(list(ber.numpy()))
-        MOBILITY_SIMS["bler"].append(list(bler.numpy()))
-
-MOBILITY_SIMS["duration"] = mos.time.time() - start
-
-#RESULTS
-# Load results (uncomment to show saved results from the cell above)
-#MOBILITY_SIMS = eval("{'ebno_db': [-5.0, -4.0, -3.0, -2.0, -1.0, 0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 9.0, 10.0, 11.0, 12.0, 13.0, 14.0, 15.0], 'scenario': ['umi', 'uma', 'rma'], 'perfect_csi': [True, False], 'ber': [[0.07905292510986328, 0.03808736801147461, 0.017681360244750977, 0.009239894087596606, 0.0050665537516276045, 0.0027629886053304755, 0.0016827532040175571, 0.0008500541736877042, 0.0004983015045593167, 0.00031632105509440104, 0.00018594996134440104, 0.00010455576578776041, 6.090927124023438e-05, 3.9520263671875e-05, 2.5684356689453124e-05, 1.4940897623697916e-05, 7.539113362630208e-06, 4.683176676432292e-06, 3.59344482421875e-06, 1.5436808268229167e-06, 7.578531901041666e-07], [0.29719797770182294, 0.26843706766764325, 0.2296581268310547, 0.17483605278862846, 0.10778331756591797, 0.07155566745334202, 0.04232830471462674, 0.022064606348673504, 0.015027618408203125, 0.008189432548754143, 0.005684130119554924, 0.00370962642928929, 0.002616008663393743, 0.0019156403011745876, 0.0015677095994417248, 0.0013081868489583333, 0.0010344430083840252, 0.0010432377567997685, 0.0009155009900555915, 0.0009102860117346291, 0.0008864811488560267], [0.06746260325113933, 0.0329127311706543, 0.014757650869864004, 0.007593437477394387, 0.003813561333550347, 0.0018911941496331237, 0.001028917273696588, 0.000513251788663255, 0.0002842496236165365, 0.00016032155354817708, 8.596547444661459e-05, 4.677454630533854e-05, 2.0359039306640624e-05, 1.1446634928385416e-05, 1.0133107503255209e-05, 3.92913818359375e-07, 1.682281494140625e-06, 6.421407063802083e-07, 1.3987223307291666e-08, 4.895528157552083e-07, 1.2715657552083333e-09], [0.2960662841796875, 0.2712268829345703, 0.2315998077392578, 0.17950481838650173, 0.11626561482747395, 0.0681504143608941, 0.04071949146412037, 0.02562223161969866, 0.014265790397738233, 0.009787991515591614, 0.006755871242947049, 0.004930473776424632, 0.003845776165569867, 0.003375189644949777, 0.0026965757616523173, 0.002434003298685431, 0.002402254330214634, 0.0021742226420969203, 0.0020746665425819925, 0.0021730139552350023, 0.0022606077648344492], [0.09145228068033855, 0.06702995300292969, 0.05034939448038737, 0.03308937766335227, 0.024936834971110027, 0.018199747258966618, 0.014243278974368249, 0.010329062478584155, 0.00815982288784451, 0.006009458884214744, 0.004231770833333333, 0.0033478243597622574, 0.0025576324126052015, 0.0019759736530521373, 0.0014438384618514623, 0.001123528113731971, 0.0008716690492438504, 0.0006736387408842243, 0.0004936694871486797, 0.00040878831294544955, 0.0002836583455403646], [0.2979132334391276, 0.2661628723144531, 0.22218640645345053, 0.1630952623155382, 0.11636797587076823, 0.08418807983398438, 0.06609598795572917, 0.047115184642650465, 0.035385449727376304, 0.026970704396565754, 0.02249379743609512, 0.016286409818209134, 0.011899021693638392, 0.008838085418051861, 0.007266274813948007, 0.005744590415610923, 0.0042660244551720895, 0.003129789240790991, 0.002527833716269651, 0.002067384265718006, 0.0014839694274598686]], 'bler': [[0.53173828125, 0.26806640625, 0.1279296875, 0.0637600806451613, 0.03380926724137931, 0.017422566371681415, 0.010500672043010752, 0.00547640931372549, 0.0030405569595645414, 0.001916015625, 0.0010703125, 0.00063671875, 0.00039453125, 0.000236328125, 0.000154296875, 9.1796875e-05, 6.25e-05, 3.515625e-05, 2.5390625e-05, 1.5625e-05, 1.171875e-05], [1.0, 1.0, 0.994140625, 0.86328125, 0.59619140625, 0.392578125, 0.2348090277777778, 0.127197265625, 0.081484375, 0.04469992897727273, 0.03009588068181818, 0.019152002427184466, 0.01331313775510204, 0.01019287109375, 0.008390893240343348, 0.00784375, 0.007462130248091603, 0.008697916666666666, 0.01016029792746114, 0.011945026676829269, 0.014048549107142858], [0.49609375, 0.25244140625, 0.10894097222222222, 0.05495876736111111, 0.026328125, 0.01235750786163522, 0.006649925595238095, 0.0034094621080139375, 0.001748046875, 0.0010078125, 0.000537109375, 0.000291015625, 0.000130859375, 9.1796875e-05, 6.0546875e-05, 9.765625e-06, 1.953125e-05, 1.3671875e-05, 5.859375e-06, 3.90625e-06, 1.953125e-06], [1.0, 1.0, 0.9951171875, 0.8912760416666666, 0.62353515625, 0.3834635416666667, 0.2265625, 0.14020647321428573, 0.07458043981481481, 0.050380608974358976, 0.03264973958333333, 0.023115808823529413, 0.017648507882882882, 0.015516493055555556, 0.013366284013605442, 0.013377568493150685, 0.015814012096774195, 0.017085597826086957, 0.0193958849009901, 0.02383753765060241, 0.02837611607142857], [0.5185546875, 0.3645833333333333, 0.267822265625, 0.17844460227272727, 0.128662109375, 0.09259588068181818, 0.07241030092592593, 0.05180921052631579, 0.041056315104166664, 0.030048076923076924, 0.021399456521739132, 0.016904633620689655, 0.013012210264900662, 0.01011981865284974, 0.007512019230769231, 0.0060276442307692305, 0.004715737951807229, 0.0035807291666666665, 0.0027969644134477824, 0.0022843567251461987, 0.001625], [1.0, 1.0, 0.9765625, 0.7649739583333334, 0.55517578125, 0.40625, 0.30747767857142855, 0.22200520833333334, 0.169921875, 0.1259765625, 0.10546875, 0.0751953125, 0.05613839285714286, 0.041555851063829786, 0.034078663793103446, 0.026551942567567568, 0.02025612113402062, 0.014954079198473283, 0.012090203220858896, 0.009994818239795918, 0.007302355410447761]], 'duration': 14960.869339227676}")
-
-mos.plt.figure()
-mos.plt.xlabel(r"$E_b/N_0$ (dB)")
-mos.plt.ylabel("BLER")
-mos.plt.grid(which="both")
-
-i=0
-legend = []
-for scenario in MOBILITY_SIMS["scenario"]:
-    for speed in MOBILITY_SIMS["speed"]:
-        if scenario=="umi":
-            t = "UMi"
-        elif scenario=="uma":
-            t = "UMa"
-        else:
-            t = "RMa"
-
-        mos.plt.semilogy(MOBILITY_SIMS["ebno_db"], MOBILITY_SIMS["bler"][i]);
-        
-        s = "{} - {} CSI {}[m/s]".format(t,"perf.", speed)
-        legend.append(s)
-        
-        i += 1
-        
-mos.plt.legend(legend)
-mos.plt.ylim([1e-3, 1])
-mos.plt.title("Different 3GPP 38.901 Models Multiuser 4x8 MIMO Uplink - impact of UT mobility ");
\ No newline at end of file
+# Saved results, reload them with --load to plot without simulating
+RESULTS_FILE = "mobility_sims.npz"
+
+
+def simulate_scenario(scenario, encoder=None, decoder=None):
+    """Simulate BER/BLER [num_speeds, num_snr] of one scenario for all UT speeds"""
+    import scripts.MimoOfdmSysModelHeader as mos
+
+    # One model (and thus one XLA compilation) per scenario; the UT speed is
+    # a model variable that is updated in place
+    model = mos.MimoOfdmSystemModel(scenario=scenario,
+                                perfect_csi=MOBILITY_SIMS["perfect_csi"][0],
+                                speed=MOBILITY_SIMS["speed"][0],
+                                encoder=encoder,
+                                decoder=decoder)
+
+    ber = np.empty((len(MOBILITY_SIMS["speed"]), len(MOBILITY_SIMS["ebno_db"])))
+    bler = np.empty_like(ber)
+    for j, speed in enumerate(MOBILITY_SIMS["speed"]):
+        model.set_speed(speed)
+
+        # All SNR points share one forward pass, hence the smaller per-SNR batch
+        ber_j, bler_j = mos.sim_ber_batched(model,
+                                        MOBILITY_SIMS["ebno_db"],
+                                        batch_size=64,
+                                        max_mc_iter=400,
+                                        num_target_block_errors=1000)
+        ber[j] = ber_j.numpy()
+        bler[j] = bler_j.numpy()
+
+    return ber, bler, model
+
+
+def _init_worker(gpu_queue):
+    """Pin a worker process to its own GPU before tensorflow gets imported"""
+    os.environ["CUDA_VISIBLE_DEVICES"] = gpu_queue.get()
+
+
+def _simulate_scenario_worker(scenario):
+    ber, bler, _ = simulate_scenario(scenario)
+    return ber, bler
+
+
+def _visible_gpu_ids(num_gpus):
+    """IDs of the GPUs visible to this process, honoring CUDA_VISIBLE_DEVICES"""
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+    if visible:
+        return [d.strip() for d in visible.split(",") if d.strip()][:num_gpus]
+    return [str(gpu) for gpu in range(num_gpus)]
+
+
+def run_simulations(mos, multi_gpu=False):
+    """Simulate all scenarios and save the results to RESULTS_FILE"""
+    # Results indexed by [scenario, speed, ebno_db]
+    results_shape = (len(MOBILITY_SIMS["scenario"]),
+                     len(MOBILITY_SIMS["speed"]),
+                     len(MOBILITY_SIMS["ebno_db"]))
+    MOBILITY_SIMS["ber"] = np.empty(results_shape)
+    MOBILITY_SIMS["bler"] = np.empty(results_shape)
+
+    start = time.time()
+
+    num_gpus = len(mos.tf.config.list_physical_devices('GPU'))
+    if multi_gpu and num_gpus > 1:
+        # Scenarios are independent: simulate them concurrently with one
+        # process per GPU. "spawn" makes every worker import tensorflow afresh
+        # after CUDA_VISIBLE_DEVICES is set. The workers must be importable,
+        # so this is only available when run as a script, not from a notebook.
+        ctx = mp.get_context("spawn")
+        gpu_queue = ctx.Queue()
+        for gpu in _visible_gpu_ids(num_gpus):
+            gpu_queue.put(gpu)
+        with ctx.Pool(min(num_gpus, len(MOBILITY_SIMS["scenario"])),
+                      initializer=_init_worker,
+                      initargs=(gpu_queue,)) as pool:
+            results = pool.map(_simulate_scenario_worker, MOBILITY_SIMS["scenario"])
+        for i, (ber, bler) in enumerate(results):
+            MOBILITY_SIMS["ber"][i] = ber
+            MOBILITY_SIMS["bler"][i] = bler
+    else:
+        # LDPC encoder/decoder are scenario-independent: build them with the first
+        # model and share them with all following ones
+        encoder, decoder = None, None
+        for i, scenario in enumerate(MOBILITY_SIMS["scenario"]):
+            ber, bler, model = simulate_scenario(scenario, encoder, decoder)
+            encoder, decoder = model.encoder, model.decoder
+            MOBILITY_SIMS["ber"][i] = ber
+            MOBILITY_SIMS["bler"][i] = bler
+
+    MOBILITY_SIMS["duration"] = time.time() - start
+
+    # Save results
+    np.savez_compressed(RESULTS_FILE,
+                        ebno_db=np.asarray(MOBILITY_SIMS["ebno_db"]),
+                        scenario=np.asarray(MOBILITY_SIMS["scenario"]),
+                        speed=np.asarray(MOBILITY_SIMS["speed"]),
+                        ber=MOBILITY_SIMS["ber"],
+                        bler=MOBILITY_SIMS["bler"],
+                        duration=MOBILITY_SIMS["duration"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="UT mobility impact study")
+    parser.add_argument("--load", action="store_true",
+                        help="plot the results saved in {} instead of simulating".format(RESULTS_FILE))
+    parser.add_argument("--multi-gpu", action="store_true",
+                        help="simulate the scenarios in parallel, one process per GPU")
+    args, _ = parser.parse_known_args()
+
+    import scripts.MimoOfdmSysModelHeader as mos
+
+    #RESULTS
+    if args.load:
+        data = np.load(RESULTS_FILE)
+        MOBILITY_SIMS.update({key : data[key] for key in data.files})
+    else:
+        run_simulations(mos, args.multi_gpu)
+
+    plot_metric("ber", "BER")
+    plot_metric("bler", "BLER")